@@ -0,0 +1,241 @@
+"""ASGI entry point for the backend.
+
+/upload and /upload/stream are served natively on the event loop: the Gemini call uses the
+async client and the single-flight wait uses async Redis, so a slow model stream holds a
+coroutine instead of a worker thread. Short CPU and Redis steps (image preprocessing, cache
+lookups, saving) run in the threadpool. The new analysis is saved through the write-behind
+queue, so no database I/O happens on the request path. Every other route is served by the
+Flask app in app.py, mounted as a WSGI app.
+
+Usage:
+    python asgi.py
+    uvicorn asgi:app --host 0.0.0.0 --port 5001 --workers 4
+"""
+import os
+import time
+import uuid
+import contextlib
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route, Mount
+from a2wsgi import WSGIMiddleware
+
+import app as backend
+
+# Threads serving the mounted Flask routes (reads, batch uploads, admin endpoints)
+WSGI_THREADS = int(os.getenv('WSGI_THREADS', '10'))
+
+# Async Redis client for waiting on in-flight analyses
+def create_async_redis_client():
+    import redis.asyncio
+    return redis.asyncio.Redis.from_url(backend.redis_url, decode_responses=True)
+
+async_redis_client = backend.LazyClient(create_async_redis_client)
+
+
+# Helper function to record the latency of a request served by this module
+def record_latency(start, method, endpoint, status):
+    backend.REQUEST_LATENCY.observe(time.perf_counter() - start, method=method, endpoint=endpoint, status=status)
+
+
+# Helper function to read the uploaded image from a multipart form
+# Returns the raw bytes, or raises ValueError with the same messages the Flask route uses
+async def read_upload(request):
+    form = await request.form()
+    file = form.get('image')
+    if file is None or isinstance(file, str):
+        raise ValueError('No image file provided')
+    if file.filename == '':
+        raise ValueError('No selected file')
+    return await file.read()
+
+
+# Async variant of acquire_or_wait_inflight
+async def acquire_or_wait_inflight(image_hash):
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + backend.INFLIGHT_WAIT_TIMEOUT
+    pubsub = None
+    try:
+        while True:
+            if await async_redis_client.set(f"inflight:{image_hash}", token, nx=True, ex=backend.INFLIGHT_LEASE):
+                # The previous leader may have finished between our cache check and taking the lease
+                cached_result = await run_in_threadpool(backend.get_cached_analysis, image_hash)
+                if cached_result:
+                    await run_in_threadpool(backend.release_inflight, image_hash, token)
+                    return cached_result, None
+                backend.hold_inflight_lease(image_hash, token)
+                return None, token
+
+            if pubsub is None:
+                print(f"Waiting for in-flight analysis of image hash: {image_hash}")
+                pubsub = async_redis_client.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(f"inflight_done:{image_hash}")
+            # Subscribe first, then check, so a result published in between is not missed
+            cached_result = await run_in_threadpool(backend.get_cached_analysis, image_hash)
+            if cached_result:
+                await run_in_threadpool(backend.increment_cache_counter, 'coalesced')
+                return cached_result, None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, None
+            # A lease that is gone without a result means the leader failed; loop to take over
+            if await async_redis_client.exists(f"inflight:{image_hash}"):
+                await pubsub.get_message(timeout=min(backend.INFLIGHT_POLL_INTERVAL, remaining))
+    except Exception as e:
+        print(f"Redis cache error: {e}")
+        return None, None
+    finally:
+        if pubsub is not None:
+            await pubsub.aclose()
+
+
+# Helper function to preprocess an upload and look it up in the cache
+# Returns (img, img_bytes, image_hash, phash, cached_result)
+def prepare_upload(raw_bytes):
+    img, img_bytes = backend.preprocess_image(raw_bytes)
+    image_hash = backend.generate_image_hash(img_bytes)
+    cached_result, phash = backend.lookup_cached_result(img, image_hash)
+    return img, img_bytes, image_hash, phash, cached_result
+
+
+# Helper function to save an analysis from the threadpool
+# save_analysis writes to the database directly when write-behind is disabled, which needs an app context
+def save_analysis(*args):
+    with backend.app.app_context():
+        return backend.save_analysis(*args)
+
+
+# Helper function to collect a streamed analysis
+async def analyze_image(img, img_bytes):
+    analysis_result = "".join([text async for text in backend.astream_analysis(img, img_bytes)])
+    return analysis_result or backend.EMPTY_ANALYSIS_RESULT
+
+
+async def upload_image(request):
+    start = time.perf_counter()
+    response = await handle_upload(request)
+    record_latency(start, request.method, '/upload', response.status_code)
+    return response
+
+
+async def handle_upload(request):
+    try:
+        raw_bytes = await read_upload(request)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    try:
+        img, img_bytes, image_hash, phash, cached_result = await run_in_threadpool(prepare_upload, raw_bytes)
+        inflight_token = None
+        if not cached_result:
+            # Only one concurrent request per image calls Gemini; the others reuse its result
+            cached_result, inflight_token = await acquire_or_wait_inflight(image_hash)
+        if cached_result:
+            print(f"Cache hit for image hash: {image_hash}")
+            return JSONResponse(backend.format_cached_result(cached_result))
+
+        try:
+            analysis_result = await analyze_image(img, img_bytes)
+            user_agent = request.headers.get('User-Agent')
+            device_type = backend.get_device_type(user_agent)
+            response_data = await run_in_threadpool(save_analysis, analysis_result, device_type, image_hash, img_bytes, phash,
+                                                    request.client.host if request.client else None, user_agent)
+            return JSONResponse(response_data)
+        finally:
+            await run_in_threadpool(backend.release_inflight, image_hash, inflight_token)
+    except backend.Overloaded as e:
+        return JSONResponse({'error': str(e)}, status_code=503, headers={'Retry-After': str(backend.OVERLOADED_RETRY_AFTER)})
+    except Exception as e:
+        print(f"Error processing image or calling Gemini API: {e}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+# Streaming variant of /upload, sending the same server-sent events as the Flask route
+async def upload_image_stream(request):
+    start = time.perf_counter()
+    try:
+        raw_bytes = await read_upload(request)
+        img, img_bytes, image_hash, phash, cached_result = await run_in_threadpool(prepare_upload, raw_bytes)
+    except Exception as e:
+        print(f"Error processing image: {e}")
+        record_latency(start, request.method, '/upload/stream', 400)
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    ip_address = request.client.host if request.client else None
+    user_agent = request.headers.get('User-Agent')
+    device_type = backend.get_device_type(user_agent)
+
+    async def generate():
+        nonlocal cached_result
+        inflight_token = None
+        try:
+            if not cached_result:
+                cached_result, inflight_token = await acquire_or_wait_inflight(image_hash)
+            if cached_result:
+                print(f"Cache hit for image hash: {image_hash}")
+                formatted_result = backend.format_cached_result(cached_result)
+                yield backend.format_sse('chunk', {'text': formatted_result['analysis']})
+                yield backend.format_sse('done', formatted_result)
+                return
+
+            analysis_result = ""
+            async for text in backend.astream_analysis(img, img_bytes):
+                analysis_result += text
+                yield backend.format_sse('chunk', {'text': text})
+            if not analysis_result:
+                analysis_result = backend.EMPTY_ANALYSIS_RESULT
+                yield backend.format_sse('chunk', {'text': analysis_result})
+
+            # Persist and cache once the stream has finished
+            response_data = await run_in_threadpool(save_analysis, analysis_result, device_type, image_hash, img_bytes, phash,
+                                                    ip_address, user_agent)
+            yield backend.format_sse('done', response_data)
+        except Exception as e:
+            print(f"Error processing image or calling Gemini API: {e}")
+            yield backend.format_sse('error', {'error': str(e)})
+        finally:
+            await run_in_threadpool(backend.release_inflight, image_hash, inflight_token)
+            record_latency(start, request.method, '/upload/stream', 200)
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+# Create the clients before the worker accepts requests (WARM_UP_ON_START)
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    if backend.WARM_UP_ON_START:
+        await run_in_threadpool(backend.warm_up)
+    yield
+
+
+app = Starlette(
+    lifespan=lifespan,
+    routes=[
+        Route('/upload', upload_image, methods=['POST']),
+        Route('/upload/stream', upload_image_stream, methods=['POST']),
+        # Everything else is served by the Flask app
+        Mount('/', app=WSGIMiddleware(backend.app, workers=WSGI_THREADS)),
+    ],
+    middleware=[
+        # Same policy as CORS(app) in app.py; preflight requests for mounted routes are answered here too
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+    ],
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(
+        'asgi:app',
+        host=os.getenv('HOST', '0.0.0.0'),
+        port=int(os.getenv('PORT', '5001')),
+        workers=int(os.getenv('WEB_CONCURRENCY', '1')),
+    )
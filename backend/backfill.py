@@ -0,0 +1,305 @@
+"""Offline backfill job runner for the Analysis table.
+
+Recomputes derived data for existing rows without loading the table into memory:
+
+    parse      re-run food item and calorie parsing on the stored analysis text
+               (fills food_items, total_kcal and analysis_food_item)
+    reanalyze  send stored images (see image_store.py) to the inference backend again and
+               replace the analysis text and its parsed fields, e.g. after a prompt or model change
+
+Rows are read in primary key order, one page at a time, with a server-side cursor
+(stream_results + yield_per). Chunks of rows are processed in a process pool, and results
+are written back with batched UPDATEs between pages, so no read transaction stays open for
+the whole run. Progress is saved to a checkpoint file after every committed batch; running
+the same command again resumes from it.
+
+Usage:
+    python backfill.py parse --workers 4
+    python backfill.py reanalyze --workers 8 --rate 60
+    python backfill.py parse --dry-run --limit 1000
+
+Reanalysis must be rate limited across all workers: --rate installs a token bucket in Redis that
+only the backfill uses, so it never sends more than that many Gemini requests per minute. Without
+--rate, the job runs only if GEMINI_REQUESTS_PER_MINUTE is set, and then shares that bucket with
+the web workers on equal terms (bulk priority only orders calls within one process). Updated rows
+are evicted from the cache as they are written.
+"""
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+from collections import deque, Counter
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Columns each job reads, besides the ID
+JOB_COLUMNS = {
+    'parse': ['image_filename', 'analysis_result', 'food_items', 'total_kcal'],
+    'reanalyze': ['image_filename', 'analysis_result', 'food_items', 'total_kcal'],
+}
+
+# Redis key of the token bucket installed by --rate
+BACKFILL_RATE_LIMIT_KEY = "rate_limit:gemini:backfill"
+BACKFILL_QUEUE_TIMEOUT = 600  # Seconds a worker may wait for a rate limit token; nobody is waiting on a response
+
+# The app module, imported once per worker process
+backend = None
+
+
+def init_worker(rate=None):
+    global backend
+    import app
+    backend = app
+    if rate:
+        from throttle import TokenBucket
+        backend.gemini_throttle.bucket = TokenBucket(backend.redis_client, BACKFILL_RATE_LIMIT_KEY, rate / 60, 1)
+        backend.gemini_throttle.queue_timeout = BACKFILL_QUEUE_TIMEOUT
+
+
+# Helper function to decode Analysis.analysis_result, which is stored JSON-encoded
+def decode_analysis_result(value):
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return value
+
+
+# Helper function to run inference again on a stored image
+def reanalyze_row(row):
+    image_hash = row['image_filename'].split('.')[0]
+    path = backend.image_store.find(image_hash)
+    if not path:
+        raise ValueError(f"Image {row['image_filename']} is not in the image store")
+    with open(path, 'rb') as f:
+        img_bytes = f.read()
+    # Stored images are already normalized; preprocessing them again would re-encode the JPEG
+    img = Image.open(io.BytesIO(img_bytes))
+    analysis_result = "".join(backend.stream_analysis(img, img_bytes, backend.PRIORITY_BULK))
+    return analysis_result or backend.EMPTY_ANALYSIS_RESULT
+
+
+# Helper function to load the stored food items of analyses, as {id: Counter of (name, kcal)}
+def load_items(ids):
+    AnalysisFoodItem = backend.AnalysisFoodItem
+    items = {}
+    with backend.app.app_context():
+        query = backend.db.select(AnalysisFoodItem.analysis_id, AnalysisFoodItem.name, AnalysisFoodItem.kcal) \
+            .where(AnalysisFoodItem.analysis_id.in_(ids))
+        for analysis_id, name, kcal in backend.db.session.execute(query):
+            items.setdefault(analysis_id, Counter())[(name, kcal)] += 1
+        backend.db.session.remove()
+    return items
+
+
+# Process one chunk of rows in a worker
+# Returns (updates, errors): updates holds the changed column values per row, errors (id, message) pairs
+def process_chunk(job, rows, force):
+    updates = []
+    errors = []
+    stored_items = load_items([row['id'] for row in rows]) if not force else {}
+    for row in rows:
+        try:
+            # image_hash is not a column; it names the cached upload response to evict
+            update = {'id': row['id'], 'image_hash': row['image_filename'].split('.')[0] if row['image_filename'] else None}
+            if job == 'reanalyze':
+                analysis_result = reanalyze_row(row)
+                update['analysis_result'] = json.dumps(analysis_result)
+            else:
+                analysis_result = decode_analysis_result(row['analysis_result'])
+            fields = backend.extract_structured_fields(analysis_result)
+            update['food_items'] = fields['food_items']
+            update['total_kcal'] = fields['total_kcal']
+            update['items'] = fields['items']
+            unchanged = all(update[column] == row[column] for column in ('analysis_result', 'food_items', 'total_kcal') if column in update) \
+                and Counter(update['items']) == stored_items.get(row['id'], Counter())
+            if force or not unchanged:
+                updates.append(update)
+        except Exception as e:
+            errors.append((row['id'], str(e)))
+    return updates, errors
+
+
+# Helper function to write a batch of updates in one transaction
+# Food item rows are replaced, so they always match the new food_items
+def write_updates(updates):
+    db, Analysis, AnalysisFoodItem = backend.db, backend.Analysis, backend.AnalysisFoodItem
+    ids = [update['id'] for update in updates]
+    db.session.execute(db.update(Analysis), [
+        {column: value for column, value in update.items() if column not in ('items', 'image_hash')} for update in updates
+    ])
+    db.session.execute(db.delete(AnalysisFoodItem).where(AnalysisFoodItem.analysis_id.in_(ids)))
+    item_rows = [{'analysis_id': update['id'], 'name': name, 'kcal': kcal} for update in updates for name, kcal in update['items']]
+    if item_rows:
+        db.session.execute(db.insert(AnalysisFoodItem), item_rows)
+    db.session.commit()
+
+
+# Helper function to evict updated analyses, the cached pages that contain them and the cached
+# upload responses for their images (in Redis and every app worker's in-process cache)
+def invalidate_updated(updates):
+    try:
+        ids = [update['id'] for update in updates]
+        image_keys = [backend.cache_key(f"image_analysis:{update['image_hash']}") for update in updates if update['image_hash']]
+        pipe = backend.redis_client.pipeline()
+        refs_keys = [backend.cache_key(f"analyses_page_refs:{analysis_id}") for analysis_id in ids]
+        for refs_key in refs_keys:
+            pipe.smembers(refs_key)
+        page_keys = set().union(*pipe.execute()) if refs_keys else set()
+        backend.invalidate_cache_keys([*(backend.cache_key(f"analysis:{analysis_id}") for analysis_id in ids), *image_keys, *refs_keys, *page_keys])
+    except Exception as e:
+        print(f"Redis cache error: {e}")
+
+
+def load_checkpoint(path, job):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('job') != job:
+        raise SystemExit(f"Checkpoint {path} belongs to the '{checkpoint.get('job')}' job; pass --restart or another --checkpoint")
+    return checkpoint
+
+
+# Write the checkpoint atomically, so an interrupted run never leaves a truncated file
+def save_checkpoint(path, checkpoint):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(temp_path, path)
+
+
+class Progress:
+    def __init__(self, total, checkpoint, interval):
+        self.total = total
+        self.checkpoint = checkpoint
+        self.interval = interval
+        self.start = time.monotonic()
+        self.start_processed = checkpoint['processed']
+        self.last_report = 0
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        processed = self.checkpoint['processed']
+        rate = (processed - self.start_processed) / max(now - self.start, 1e-9)
+        line = f"processed {processed}"
+        if self.total is not None:
+            remaining = max(0, self.total - processed)
+            line += f"/{self.total} ({100 * processed / max(self.total, 1):.1f}%)"
+            if rate > 0:
+                line += f", ETA {remaining / rate:.0f}s"
+        line += f", updated {self.checkpoint['updated']}, errors {self.checkpoint['errors']}, {rate:.1f} rows/s"
+        print(line, flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backfill derived data over the Analysis table")
+    parser.add_argument('job', choices=sorted(JOB_COLUMNS))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument('--chunk-size', type=int, default=200, help="Rows per worker task (also the yield_per size)")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Rows per UPDATE transaction")
+    parser.add_argument('--page-size', type=int, default=20000, help="Rows read per server-side cursor before writing")
+    parser.add_argument('--rate', type=float, default=None, help="Gemini requests per minute across all workers (reanalyze only)")
+    parser.add_argument('--pause', type=float, default=0, help="Seconds to sleep between pages, to limit load on the database")
+    parser.add_argument('--limit', type=int, default=None, help="Stop after this many rows")
+    parser.add_argument('--checkpoint', default=None, help="Checkpoint file (default: backfill-<job>.checkpoint.json)")
+    parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint and start from the first row")
+    parser.add_argument('--force', action='store_true', help="Write every row, even if its values did not change")
+    parser.add_argument('--dry-run', action='store_true', help="Compute and count changes without writing them")
+    parser.add_argument('--progress-interval', type=float, default=5, help="Seconds between progress lines")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    init_worker()
+    if args.job == 'reanalyze' and not args.rate and not backend.GEMINI_REQUESTS_PER_MINUTE:
+        raise SystemExit("reanalyze needs a rate limit shared by all workers: pass --rate <requests per minute> or set GEMINI_REQUESTS_PER_MINUTE")
+    db, Analysis = backend.db, backend.Analysis
+    checkpoint_path = args.checkpoint or f"backfill-{args.job}.checkpoint.json"
+    checkpoint = None if args.restart else load_checkpoint(checkpoint_path, args.job)
+    if checkpoint:
+        print(f"Resuming from checkpoint {checkpoint_path} after ID {checkpoint['last_id']}")
+    else:
+        checkpoint = {'job': args.job, 'last_id': None, 'processed': 0, 'updated': 0, 'errors': 0}
+
+    columns = [Analysis.id, *(getattr(Analysis, name) for name in JOB_COLUMNS[args.job])]
+    # Reanalysis is only possible for rows whose image was stored
+    condition = Analysis.image_filename.isnot(None) if args.job == 'reanalyze' else db.true()
+
+    with backend.app.app_context():
+        total = db.session.execute(db.select(db.func.count()).select_from(Analysis).where(condition)).scalar()
+        progress = Progress(total, checkpoint, args.progress_interval)
+        print(f"Running '{args.job}' over {total} rows with {args.workers} workers...")
+
+        # Spawn rather than fork, so workers never inherit open database or gRPC connections
+        context = multiprocessing.get_context('spawn')
+        started_rows = 0
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=context, initializer=init_worker,
+                                 initargs=(args.rate,)) as executor:
+            while args.limit is None or started_rows < args.limit:
+                page_size = args.page_size if args.limit is None else min(args.page_size, args.limit - started_rows)
+                query = db.select(*columns).where(condition).order_by(Analysis.id).limit(page_size)
+                if checkpoint['last_id'] is not None:
+                    query = query.where(Analysis.id > checkpoint['last_id'])
+
+                # Stream one page to the workers; results are kept in submission order
+                pending = deque()
+                page_rows = 0
+                with db.engine.connect() as connection:
+                    result = connection.execution_options(stream_results=True, yield_per=args.chunk_size).execute(query)
+                    for partition in result.mappings().partitions():
+                        rows = [dict(row) for row in partition]
+                        pending.append((rows[-1]['id'], len(rows), executor.submit(process_chunk, args.job, rows, args.force)))
+                        page_rows += len(rows)
+                if not page_rows:
+                    break
+                started_rows += page_rows
+
+                # Write the page back in batches, advancing the checkpoint after each commit
+                batch = []
+                batch_rows = 0
+                while pending:
+                    last_id, row_count, future = pending.popleft()
+                    updates, errors = future.result()
+                    for analysis_id, message in errors:
+                        print(f"Error processing analysis {analysis_id}: {message}")
+                    batch.extend(updates)
+                    batch_rows += row_count
+                    checkpoint['errors'] += len(errors)
+                    if len(batch) >= args.batch_size or not pending:
+                        if batch and not args.dry_run:
+                            try:
+                                write_updates(batch)
+                            except Exception:
+                                db.session.rollback()
+                                raise
+                            invalidate_updated(batch)
+                        checkpoint['updated'] += len(batch)
+                        checkpoint['processed'] += batch_rows
+                        checkpoint['last_id'] = last_id
+                        if not args.dry_run:
+                            save_checkpoint(checkpoint_path, checkpoint)
+                        batch = []
+                        batch_rows = 0
+                        progress.report()
+
+                if args.pause:
+                    time.sleep(args.pause)
+
+    progress.report(force=True)
+    verb = "would update" if args.dry_run else "updated"
+    print(f"Done: processed {checkpoint['processed']} rows, {verb} {checkpoint['updated']}, {checkpoint['errors']} errors")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""Load-test and benchmark harness for the Flask backend.
+
+Runs app.py in a local threaded HTTP server (or asgi.py under uvicorn with --server asgi)
+with a fake Gemini model that streams
+chunks at a configurable latency, SQLite instead of PostgreSQL, and fakeredis (or a
+local Redis), then drives it with concurrent requests and reports latency
+percentiles, throughput and cache hit rates.
+
+Usage:
+    python benchmark.py --scenario mixed --requests 500 --concurrency 16 --output results.json
+
+fakeredis is only needed for --redis fake (pip install fakeredis).
+"""
+import os
+import io
+import sys
+import json
+import math
+import time
+import glob
+import asyncio
+import random
+import tempfile
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'images')
+
+
+# Stand-in for genai.GenerativeModel that streams a canned answer
+class FakeGeminiChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    def __init__(self, first_chunk_latency, chunk_latency, chunks):
+        self.first_chunk_latency = first_chunk_latency
+        self.chunk_latency = chunk_latency
+        self.chunks = chunks
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def answer_pieces(self):
+        with self.lock:
+            self.calls += 1
+        text = "Identified food: [apple (95 kcal), banana (105 kcal)]. Estimated calories: 200 kcal."
+        size = max(1, len(text) // self.chunks)
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def generate_content(self, prompt_parts, generation_config=None, stream=False, request_options=None):
+        pieces = self.answer_pieces()
+
+        def generate():
+            time.sleep(self.first_chunk_latency)
+            for index, piece in enumerate(pieces):
+                if index:
+                    time.sleep(self.chunk_latency)
+                yield FakeGeminiChunk(piece)
+        return generate()
+
+    # Used by the ASGI server (asgi.py)
+    async def generate_content_async(self, prompt_parts, generation_config=None, stream=False, request_options=None):
+        pieces = self.answer_pieces()
+
+        async def generate():
+            await asyncio.sleep(self.first_chunk_latency)
+            for index, piece in enumerate(pieces):
+                if index:
+                    await asyncio.sleep(self.chunk_latency)
+                yield FakeGeminiChunk(piece)
+        return generate()
+
+
+# Helper function to build the upload corpus from images/
+# Each photo is included as-is plus resized and re-encoded copies to exercise the near-duplicate cache
+def build_corpus(variants):
+    from PIL import Image
+
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(IMAGES_DIR, '*.jpeg'))):
+        with open(path, 'rb') as f:
+            corpus.append((os.path.basename(path), f.read()))
+        img = Image.open(path).convert('RGB')
+        for variant in range(variants):
+            scale = 0.9 - 0.1 * variant
+            resized = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))))
+            output = io.BytesIO()
+            resized.save(output, format='JPEG', quality=80 - 5 * variant)
+            corpus.append((f"{variant}-{os.path.basename(path)}", output.getvalue()))
+    return corpus
+
+
+# Helper function to encode a multipart/form-data body for /upload
+def multipart_body(filename, data):
+    boundary = f"----benchmark{random.getrandbits(64):x}"
+    body = (
+        f"--{boundary}\r\n"
+        f"Content-Disposition: form-data; name=\"image\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+# Helper function to send one request and return (status, seconds, response JSON)
+def send(base_url, endpoint, method='GET', body=None, content_type=None):
+    request = urllib.request.Request(base_url + endpoint, data=body, method=method)
+    if content_type:
+        request.add_header('Content-Type', content_type)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            payload = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        payload = e.read()
+        status = e.code
+    except Exception as e:
+        print(f"Request error: {e}")
+        return 0, time.perf_counter() - start, None
+    elapsed = time.perf_counter() - start
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        data = None
+    return status, elapsed, data
+
+
+# Helper function to compute a nearest-rank percentile
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct * len(sorted_values) / 100.0) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, statuses, wall_time):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': sum(1 for status in statuses if status >= 400 or status == 0),
+        'throughput_rps': round(len(latencies) / wall_time, 2) if wall_time else None,
+        'mean_ms': round(1000 * sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50_ms': round(1000 * percentile(latencies, 50), 2) if latencies else None,
+        'p95_ms': round(1000 * percentile(latencies, 95), 2) if latencies else None,
+        'p99_ms': round(1000 * percentile(latencies, 99), 2) if latencies else None,
+        'max_ms': round(1000 * latencies[-1], 2) if latencies else None,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the calorie counter backend")
+    parser.add_argument('--scenario', choices=['upload', 'analyses', 'analysis', 'mixed'], default='mixed')
+    parser.add_argument('--requests', type=int, default=200, help="Total number of requests to send")
+    parser.add_argument('--concurrency', type=int, default=8, help="Number of concurrent clients")
+    parser.add_argument('--first-chunk-latency', type=float, default=0.5, help="Fake Gemini time to first chunk (s)")
+    parser.add_argument('--chunk-latency', type=float, default=0.05, help="Fake Gemini delay between chunks (s)")
+    parser.add_argument('--chunks', type=int, default=4, help="Number of chunks per fake Gemini answer")
+    parser.add_argument('--variants', type=int, default=2, help="Resized copies of each sample image")
+    parser.add_argument('--database-url', default=None,
+                        help="Database URL (default: a temporary SQLite file); use a throwaway database, rows are added to it")
+    parser.add_argument('--redis', choices=['fake', 'local'], default='fake',
+                        help="fakeredis in-process, or the Redis at REDIS_URL (use a throwaway database number)")
+    parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi',
+                        help="Threaded WSGI server running app.py, or uvicorn running asgi.py")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="Write the results to this JSON file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+
+    # Configure the app before importing it
+    workdir = tempfile.mkdtemp(prefix='calorie-benchmark-')
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+    os.environ['SQLALCHEMY_ECHO'] = 'false'
+    os.environ['IMAGE_STORE_DIR'] = os.path.join(workdir, 'image_store')
+    if args.redis == 'fake':
+        import fakeredis
+        import redis
+        server = fakeredis.FakeServer()
+        redis.Redis.from_url = classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+        if args.server == 'asgi':
+            import fakeredis.aioredis
+            import redis.asyncio
+            redis.asyncio.Redis.from_url = classmethod(lambda cls, url, **kwargs: fakeredis.aioredis.FakeRedis(server=server, **kwargs))
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as backend
+    from werkzeug.serving import make_server
+
+    fake_model = FakeGeminiModel(args.first_chunk_latency, args.chunk_latency, args.chunks)
+    backend.inference_router.remote.model = fake_model
+    with backend.app.app_context():
+        backend.db.create_all()
+
+    # Serve the app from a background thread
+    if args.server == 'asgi':
+        import socket
+        import uvicorn
+        import asgi
+
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        http_server = uvicorn.Server(uvicorn.Config(asgi.app, log_level='warning'))
+        threading.Thread(target=http_server.run, kwargs={'sockets': [sock]}, daemon=True).start()
+        while not http_server.started:
+            time.sleep(0.05)
+        stop_server = lambda: setattr(http_server, 'should_exit', True)
+        base_url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+    else:
+        http_server = make_server('127.0.0.1', 0, backend.app, threaded=True)
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        stop_server = http_server.shutdown
+        base_url = f"http://127.0.0.1:{http_server.server_port}"
+
+    corpus = build_corpus(args.variants)
+    analysis_ids = []
+    ids_lock = threading.Lock()
+
+    # Seed a few analyses so the read scenarios have something to fetch
+    for filename, data in corpus[:3]:
+        body, content_type = multipart_body(filename, data)
+        status, elapsed, payload = send(base_url, '/upload', 'POST', body, content_type)
+        if payload and 'id' in payload:
+            analysis_ids.append(payload['id'])
+    backend.flush_pending_analyses()
+    backend.redis_client.delete(backend.CACHE_COUNTERS_KEY)
+    fake_model.calls = 0
+
+    def one_request(index):
+        scenario = args.scenario
+        if scenario == 'mixed':
+            scenario = random.choices(['upload', 'analyses', 'analysis'], weights=[2, 1, 3])[0]
+        if scenario == 'upload':
+            filename, data = random.choice(corpus)
+            body, content_type = multipart_body(filename, data)
+            status, elapsed, payload = send(base_url, '/upload', 'POST', body, content_type)
+            if payload and 'id' in payload:
+                with ids_lock:
+                    analysis_ids.append(payload['id'])
+            return '/upload', status, elapsed
+        if scenario == 'analyses':
+            status, elapsed, payload = send(base_url, '/analyses?limit=50&fields=id,created_at,food_items,total_kcal')
+            return '/analyses', status, elapsed
+        with ids_lock:
+            analysis_id = random.choice(analysis_ids)
+        status, elapsed, payload = send(base_url, f'/analyses/{analysis_id}')
+        return '/analyses/<id>', status, elapsed
+
+    print(f"Running {args.requests} '{args.scenario}' requests with concurrency {args.concurrency} against {base_url}...")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(one_request, range(args.requests)))
+    wall_time = time.perf_counter() - start
+    stop_server()
+
+    by_endpoint = {}
+    for endpoint, status, elapsed in results:
+        by_endpoint.setdefault(endpoint, ([], []))
+        by_endpoint[endpoint][0].append(elapsed)
+        by_endpoint[endpoint][1].append(status)
+
+    counters = {name: int(count) for name, count in backend.redis_client.hgetall(backend.CACHE_COUNTERS_KEY).items()}
+    lookups = counters.get('exact_hits', 0) + counters.get('perceptual_hits', 0) + counters.get('misses', 0)
+    report = {
+        'config': vars(args),
+        'wall_time_s': round(wall_time, 3),
+        'overall': summarize([r[2] for r in results], [r[1] for r in results], wall_time),
+        'endpoints': {endpoint: summarize(latencies, statuses, wall_time)
+                      for endpoint, (latencies, statuses) in sorted(by_endpoint.items())},
+        'cache': {
+            'counters': counters,
+            'upload_hit_rate': round(1 - counters.get('misses', 0) / lookups, 3) if lookups else None,
+        },
+        'gemini_calls': fake_model.calls,
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
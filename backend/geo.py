@@ -0,0 +1,153 @@
+import math
+
+# Geohash helpers for location queries, used by app.py and migrations.py.
+# A geohash interleaves longitude and latitude bits into a base32 string, so points in the same
+# cell share a prefix and every cell is one contiguous range of strings. Storing the geohash in
+# an ordinary B-tree indexed column turns "points inside this box" into a few index range scans
+# on any database, without a spatial extension.
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+BASE32_INDEX = {char: index for index, char in enumerate(BASE32)}
+
+GEOHASH_PRECISION = 12  # Stored precision, a cell of a few centimeters
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+
+# Helper function to check that coordinates are numbers within range
+def valid_coordinates(lat, lng):
+    return (isinstance(lat, (int, float)) and isinstance(lng, (int, float))
+            and not isinstance(lat, bool) and not isinstance(lng, bool)
+            and -90 <= lat <= 90 and -180 <= lng <= 180)
+
+
+def encode(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # Bits alternate between longitude (even) and latitude (odd)
+    while len(chars) < precision:
+        value, value_range = (lng, lng_range) if even else (lat, lat_range)
+        middle = (value_range[0] + value_range[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            value_range[0] = middle
+        else:
+            bits = bits * 2
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+# Size of a cell at a precision, as (height, width) in degrees
+def cell_size(precision):
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180 / 2 ** lat_bits, 360 / 2 ** lng_bits
+
+
+# Return the first string after every string starting with prefix, or None if there is none
+# Used as the exclusive upper bound of a prefix range scan; staying inside the geohash alphabet
+# keeps the comparison independent of the database collation.
+def prefix_upper_bound(prefix):
+    chars = list(prefix)
+    while chars:
+        index = BASE32_INDEX[chars[-1]]
+        if index + 1 < len(BASE32):
+            chars[-1] = BASE32[index + 1]
+            return ''.join(chars)
+        chars.pop()
+    return None
+
+
+# Merge prefixes into as few [lower, upper) ranges as possible; upper is None for an open range
+# Adjacent cells are often consecutive in geohash order, so a covering usually needs only a few ranges.
+def prefix_ranges(prefixes):
+    ranges = []
+    for prefix in sorted(prefixes):
+        upper = prefix_upper_bound(prefix)
+        if ranges and ranges[-1][1] is not None and ranges[-1][1] >= prefix:
+            ranges[-1][1] = upper if upper is None or upper > ranges[-1][1] else ranges[-1][1]
+        else:
+            ranges.append([prefix, upper])
+    return [tuple(entry) for entry in ranges]
+
+
+# Helper function to split a box crossing the antimeridian (west > east) into boxes that do not
+def split_bbox(south, west, north, east):
+    if west <= east:
+        return [(south, west, north, east)]
+    return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+
+# Helper function to find the rows and columns of the cells at a precision that intersect a box
+# The box must not cross the antimeridian.
+def cell_ranges(south, west, north, east, precision):
+    height, width = cell_size(precision)
+    rows = range(int((south + 90) // height), int(min(north + 90, 180 - height / 2) // height) + 1)
+    columns = range(int((west + 180) // width), int(min(east + 180, 360 - width / 2) // width) + 1)
+    return rows, columns
+
+
+# Return the geohash cells at a precision that intersect a box (which must not cross the antimeridian)
+def cells_in_bbox(south, west, north, east, precision):
+    height, width = cell_size(precision)
+    rows, columns = cell_ranges(south, west, north, east, precision)
+    return [encode(-90 + (row + 0.5) * height, -180 + (column + 0.5) * width, precision)
+            for row in rows for column in columns]
+
+
+# Return the finest geohash prefixes covering a box with at most max_cells cells
+# The box may cross the antimeridian (west > east). Returns (precision, sorted prefixes).
+def covering_prefixes(south, west, north, east, max_cells=32, max_precision=GEOHASH_PRECISION):
+    boxes = split_bbox(south, west, north, east)
+    precision = 1
+    while precision < max_precision:
+        count = 0
+        for box in boxes:
+            rows, columns = cell_ranges(*box, precision + 1)
+            count += len(rows) * len(columns)
+        if count > max_cells:
+            break
+        precision += 1
+    prefixes = {cell for box in boxes for cell in cells_in_bbox(*box, precision)}
+    return precision, sorted(prefixes)
+
+
+# Return the box around a point containing every point within radius_m, as (south, west, north, east)
+# Near the poles the box spans every longitude; near the antimeridian west may be greater than east.
+def bbox_around(lat, lng, radius_m):
+    lat_delta = radius_m / METERS_PER_DEGREE
+    south = max(-90.0, lat - lat_delta)
+    north = min(90.0, lat + lat_delta)
+    cos_lat = math.cos(math.radians(max(abs(south), abs(north))))
+    lng_delta = radius_m / (METERS_PER_DEGREE * cos_lat) if cos_lat > 1e-9 else 360
+    if lng_delta >= 180:
+        return south, -180.0, north, 180.0
+    west = lng - lng_delta
+    east = lng + lng_delta
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+    return south, west, north, east
+
+
+# Great-circle distance in meters (haversine)
+def distance_m(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+# Geohash precision to cluster by at a web map zoom level
+# A zoom z tile is 360 / 2**z degrees wide; clusters are cells about an eighth of a tile wide.
+def cluster_precision(zoom):
+    return max(1, min(GEOHASH_PRECISION, round((zoom + 3) * 2 / 5)))
@@ -0,0 +1,92 @@
+import os
+import re
+import tempfile
+from PIL import Image
+
+# Content-addressed image store on the local filesystem, used by app.py.
+# Each image is stored once under its content hash, sharded into two levels of directories
+# (ab/cd/abcd....jpg) so no directory grows too large. Thumbnails are generated on first
+# request and kept under thumbs/<size>/ with the same layout.
+
+# File extensions by leading bytes
+SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF8', 'gif'),
+]
+EXTENSIONS = ('jpg', 'webp', 'png', 'gif')
+HASH_PATTERN = re.compile(r'^[0-9a-f]{32,64}$')
+
+
+# Helper function to pick a file extension from the image bytes
+def detect_extension(data):
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    for signature, extension in SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    return None
+
+
+class ImageStore:
+    def __init__(self, root, thumbnail_quality=80):
+        self.root = root
+        self.thumbnail_quality = thumbnail_quality
+
+    def shard_path(self, base, image_hash, extension):
+        return os.path.join(base, image_hash[:2], image_hash[2:4], f"{image_hash}.{extension}")
+
+    # Write a file atomically, so readers never see a partial image
+    # Concurrent writers of the same content simply replace each other's identical file.
+    def write_atomic(self, path, write):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    # Store an image under its hash; returns the stored file name (<hash>.<ext>)
+    # An image that is already stored is not written again.
+    def put(self, image_hash, data):
+        extension = detect_extension(data)
+        if not extension or not HASH_PATTERN.match(image_hash):
+            raise ValueError("Unsupported image")
+        path = self.shard_path(self.root, image_hash, extension)
+        if not os.path.exists(path):
+            self.write_atomic(path, lambda f: f.write(data))
+        return os.path.basename(path)
+
+    # Return the path of a stored image, or None if it is not stored
+    def find(self, image_hash):
+        if not HASH_PATTERN.match(image_hash):
+            return None
+        for extension in EXTENSIONS:
+            path = self.shard_path(self.root, image_hash, extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    # Return the path of a JPEG thumbnail whose longest edge is size, generating it on first use
+    # Returns None if the original image is not stored.
+    def thumbnail(self, image_hash, size):
+        if not HASH_PATTERN.match(image_hash):
+            return None
+        path = self.shard_path(os.path.join(self.root, 'thumbs', str(size)), image_hash, 'jpg')
+        if os.path.exists(path):
+            return path
+        original = self.find(image_hash)
+        if not original:
+            return None
+
+        with Image.open(original) as img:
+            # Let the JPEG decoder scale down while decoding
+            img.draft('RGB', (size, size))
+            img = img.convert('RGB')
+            img.thumbnail((size, size), Image.LANCZOS)
+            self.write_atomic(path, lambda f: img.save(f, format='JPEG', quality=self.thumbnail_quality))
+        return path
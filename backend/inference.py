@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from throttle import PRIORITY_INTERACTIVE
+
+# Inference backends used by app.py to analyze food images.
+# Every backend streams its answer as text chunks in the same format the Gemini prompt asks for:
+# "Identified food: [item (number kcal), ...]. Estimated calories: [number] kcal."
+
+# Routing policies for InferenceRouter
+POLICY_REMOTE = 'remote'                    # Gemini only
+POLICY_REMOTE_FALLBACK = 'remote-fallback'  # Gemini, falling back to the local model when it fails
+POLICY_LOCAL_FIRST = 'local-first'          # Local model, escalating to Gemini on low confidence
+POLICY_LOCAL_ONLY = 'local-only'            # Local model only
+POLICIES = (POLICY_REMOTE, POLICY_REMOTE_FALLBACK, POLICY_LOCAL_FIRST, POLICY_LOCAL_ONLY)
+
+
+# Helper function to format a classification in the same format Gemini answers in
+def format_analysis(items):
+    item_text = ", ".join(f"{name} ({kcal} kcal)" for name, kcal in items)
+    total = sum(kcal for name, kcal in items)
+    return f"Identified food: [{item_text}]. Estimated calories: {total} kcal."
+
+
+# Base class for inference backends
+class InferenceBackend:
+    name = 'base'
+
+    # Yield the analysis text in one or more chunks
+    def stream(self, img, img_bytes):
+        raise NotImplementedError
+
+    # Async variant of stream(); by default runs the blocking stream in a worker thread
+    async def astream(self, img, img_bytes):
+        chunks = await asyncio.to_thread(lambda: list(self.stream(img, img_bytes)))
+        for text in chunks:
+            yield text
+
+
+# Remote backend that calls the Gemini API with streaming enabled
+class GeminiBackend(InferenceBackend):
+    name = 'gemini'
+
+    # model may be None if model_factory is given; the model is then created on first use
+    def __init__(self, model, prompt, generation_config, log_chunks=True, timeout=None, model_factory=None):
+        self.loaded_model = model
+        self.model_factory = model_factory
+        self.model_lock = threading.Lock()
+        self.prompt = prompt
+        self.generation_config = generation_config
+        self.log_chunks = log_chunks  # Print every streamed chunk (useful for debugging, costly under load)
+        self.request_options = {'timeout': timeout} if timeout else None  # Seconds before a call is abandoned
+
+    @property
+    def model(self):
+        if self.loaded_model is None:
+            with self.model_lock:
+                if self.loaded_model is None:
+                    self.loaded_model = self.model_factory()
+        return self.loaded_model
+
+    @model.setter
+    def model(self, model):
+        self.loaded_model = model
+
+    def prompt_parts(self, img, img_bytes):
+        # The API expects a list of parts, where each part can be text or image data.
+        image_part = {
+            "mime_type": f"image/{img.format.lower()}" if img.format else "image/jpeg", # Ensure format is always 'image/format'
+            "data": img_bytes
+        }
+        return [image_part, self.prompt]
+
+    def stream(self, img, img_bytes):
+        print("Sending request to Gemini API...")
+        response_stream = self.model.generate_content(
+            self.prompt_parts(img, img_bytes),
+            generation_config=self.generation_config,
+            stream=True,  # Enable streaming
+            request_options=self.request_options
+        )
+
+        print("Receiving streamed response from Gemini API:")
+        received_text = False
+        for chunk in response_stream:
+            if chunk.text:
+                received_text = True
+                if self.log_chunks:
+                    print(chunk.text, end="")
+                yield chunk.text
+
+        print("\nCompleted receiving response from Gemini API.")
+
+        if not received_text:
+            print("Warning: Empty response received from Gemini API.")
+            # Log more details for debugging
+            print(f"Response stream details: {response_stream}")
+
+    # Uses the async Gemini client, so a slow stream only holds the event loop while chunks arrive
+    async def astream(self, img, img_bytes):
+        response_stream = await self.model.generate_content_async(
+            self.prompt_parts(img, img_bytes),
+            generation_config=self.generation_config,
+            stream=True,
+            request_options=self.request_options
+        )
+        async for chunk in response_stream:
+            if chunk.text:
+                if self.log_chunks:
+                    print(chunk.text, end="")
+                yield chunk.text
+
+
+# Local CPU backend: an ONNX image classifier plus a per-food calorie lookup table
+# The labels file is JSON: {"labels": ["apple", ...], "kcal": {"apple": 95, ...}}
+# onnxruntime and numpy are optional dependencies, only needed when this backend is enabled.
+# The model is loaded on first use (or by load(), e.g. from a warm-up hook).
+class LocalBackend(InferenceBackend):
+    name = 'local'
+
+    def __init__(self, model_path, labels_path, input_size=224):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Local model not found: {model_path}")
+        self.model_path = model_path
+        self.session = None
+        self.load_lock = threading.Lock()
+        self.input_size = input_size
+        with open(labels_path) as f:
+            labels = json.load(f)
+        self.labels = labels['labels']
+        self.kcal = labels.get('kcal', {})
+
+    def load(self):
+        with self.load_lock:
+            if self.session is None:
+                import numpy
+                import onnxruntime
+
+                self.numpy = numpy
+                session = onnxruntime.InferenceSession(self.model_path, providers=['CPUExecutionProvider'])
+                self.input_name = session.get_inputs()[0].name
+                self.session = session
+
+    # Classify an image, returning (label, confidence)
+    def classify(self, img, img_bytes=None):
+        if self.session is None:
+            self.load()
+        np = self.numpy
+        img = img.convert('RGB').resize((self.input_size, self.input_size))
+        pixels = np.asarray(img, dtype=np.float32) / 255.0
+        # Normalize with the ImageNet mean/std most small classifiers are trained with
+        pixels = (pixels - np.array([0.485, 0.456, 0.406], dtype=np.float32)) / np.array([0.229, 0.224, 0.225], dtype=np.float32)
+        batch = pixels.transpose(2, 0, 1)[np.newaxis, ...]
+
+        logits = self.session.run(None, {self.input_name: batch})[0][0]
+        probabilities = np.exp(logits - logits.max())
+        probabilities /= probabilities.sum()
+        best = int(probabilities.argmax())
+        return self.labels[best], float(probabilities[best])
+
+    def analysis_for(self, label):
+        return format_analysis([(label, self.kcal.get(label, 0))])
+
+    def stream(self, img, img_bytes):
+        label, confidence = self.classify(img)
+        yield self.analysis_for(label)
+
+
+# Deterministic backend for tests and offline development
+# Picks a food from a fixed table based on the image bytes, so the same image always gets the same answer.
+class StubBackend(InferenceBackend):
+    name = 'stub'
+
+    FOODS = [('apple', 95), ('banana', 105), ('orange', 62), ('pineapple', 82), ('watermelon', 86)]
+
+    def __init__(self, confidence=1.0):
+        self.confidence = confidence
+
+    def classify(self, img, img_bytes=None):
+        digest = hashlib.md5(img_bytes or img.tobytes()).digest()
+        label, kcal = self.FOODS[digest[0] % len(self.FOODS)]
+        return label, self.confidence
+
+    def analysis_for(self, label):
+        return format_analysis([(label, dict(self.FOODS)[label])])
+
+    def stream(self, img, img_bytes):
+        label, confidence = self.classify(img, img_bytes)
+        text = self.analysis_for(label)
+        # Split into a couple of chunks to exercise streaming code paths
+        middle = len(text) // 2
+        yield text[:middle]
+        yield text[middle:]
+
+    async def astream(self, img, img_bytes):
+        for text in self.stream(img, img_bytes):
+            yield text
+
+
+# Routes each analysis to the local or remote backend according to a policy
+# Remote calls go through the optional throttle (see throttle.py); the local model is not throttled.
+class InferenceRouter:
+    def __init__(self, remote, local=None, policy=POLICY_REMOTE, confidence_threshold=0.8, remote_cooldown=30, throttle=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown inference policy: {policy}")
+        self.remote = remote
+        self.local = local
+        self.policy = policy
+        if not local and policy != POLICY_REMOTE:
+            print(f"Warning: inference policy '{policy}' needs a local model; using '{POLICY_REMOTE}' instead.")
+            self.policy = POLICY_REMOTE
+        self.confidence_threshold = confidence_threshold
+        self.remote_cooldown = remote_cooldown  # Seconds to skip the remote backend after it fails
+        self.throttle = throttle
+        self.remote_unavailable_until = 0
+        self.counters = {'local': 0, 'remote': 0, 'escalated': 0, 'fallback': 0}
+
+    # Decide whether to answer locally before trying the remote backend
+    # Returns the local answer, or None to call the remote backend
+    def local_answer(self, label, confidence):
+        remote_down = time.monotonic() < self.remote_unavailable_until
+        if self.policy == POLICY_LOCAL_ONLY or confidence >= self.confidence_threshold or remote_down:
+            self.counters['local'] += 1
+            return self.local.analysis_for(label)
+        print(f"Local model confidence {confidence:.2f} for '{label}' is low, escalating to {self.remote.name}")
+        self.counters['escalated'] += 1
+        return None
+
+    # Check whether a remote failure may be answered by the local model instead
+    def can_fall_back(self, received_text):
+        if not self.local or self.policy == POLICY_REMOTE or received_text:
+            return False
+        self.remote_unavailable_until = time.monotonic() + self.remote_cooldown
+        self.counters['fallback'] += 1
+        return True
+
+    # Stream from the remote backend, through the throttle if there is one
+    def remote_stream(self, img, img_bytes, priority):
+        if not self.throttle:
+            return self.remote.stream(img, img_bytes)
+        return self.throttle.stream(lambda: self.remote.stream(img, img_bytes), priority)
+
+    def remote_astream(self, img, img_bytes, priority):
+        if not self.throttle:
+            return self.remote.astream(img, img_bytes)
+        return self.throttle.astream(lambda: self.remote.astream(img, img_bytes), priority)
+
+    def stream(self, img, img_bytes, priority=PRIORITY_INTERACTIVE):
+        if self.policy in (POLICY_LOCAL_FIRST, POLICY_LOCAL_ONLY):
+            answer = self.local_answer(*self.local.classify(img, img_bytes))
+            if answer:
+                yield answer
+                return
+        elif self.policy == POLICY_REMOTE_FALLBACK and time.monotonic() < self.remote_unavailable_until:
+            self.counters['fallback'] += 1
+            yield from self.local.stream(img, img_bytes)
+            return
+
+        self.counters['remote'] += 1
+        received_text = False
+        try:
+            for text in self.remote_stream(img, img_bytes, priority):
+                received_text = True
+                yield text
+        except Exception as e:
+            # Only fall back if nothing has been sent yet, so answers are never mixed
+            if not self.can_fall_back(received_text):
+                raise
+            print(f"Remote inference failed ({e}), falling back to the local model")
+            yield from self.local.stream(img, img_bytes)
+
+    # Async variant of stream() for the ASGI server
+    async def astream(self, img, img_bytes, priority=PRIORITY_INTERACTIVE):
+        if self.policy in (POLICY_LOCAL_FIRST, POLICY_LOCAL_ONLY):
+            answer = self.local_answer(*await asyncio.to_thread(self.local.classify, img, img_bytes))
+            if answer:
+                yield answer
+                return
+        elif self.policy == POLICY_REMOTE_FALLBACK and time.monotonic() < self.remote_unavailable_until:
+            self.counters['fallback'] += 1
+            async for text in self.local.astream(img, img_bytes):
+                yield text
+            return
+
+        self.counters['remote'] += 1
+        received_text = False
+        try:
+            async for text in self.remote_astream(img, img_bytes, priority):
+                received_text = True
+                yield text
+        except Exception as e:
+            if not self.can_fall_back(received_text):
+                raise
+            print(f"Remote inference failed ({e}), falling back to the local model")
+            async for text in self.local.astream(img, img_bytes):
+                yield text
@@ -0,0 +1,81 @@
+import time
+import threading
+from collections import OrderedDict
+
+# In-process LRU cache with a TTL and a memory budget, used in front of Redis by app.py.
+# Entries are evicted least-recently-used first once the total size passes max_bytes.
+# Callers pass each value's size (the length of its JSON encoding is a good estimate).
+
+# Approximate per-entry overhead of the key, tuple and OrderedDict node
+ENTRY_OVERHEAD = 200
+
+
+class LRUCache:
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, size, expires_at)
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Return the cached value, or None if it is missing or expired
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if time.monotonic() >= expires_at:
+                self.remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size):
+        size += ENTRY_OVERHEAD
+        # Values bigger than a quarter of the budget would flush too much of the cache
+        if size > self.max_bytes // 4:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self.remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    # Remove an entry; the caller must hold the lock
+    def remove(self, key):
+        value, size, expires_at = self.entries.pop(key)
+        self.current_bytes -= size
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+            }
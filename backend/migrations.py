@@ -0,0 +1,196 @@
+"""Versioned schema migrations for the backend database.
+
+Each migration runs once, in version order, and is recorded in the schema_version table.
+On PostgreSQL the whole run holds an advisory lock, so several deploy jobs or processes
+started at once apply each migration exactly once; every migration commits together with
+its version row. Migrations must be idempotent: version 1 creates any missing tables from
+the current models, so later migrations also have to work on a database that already has
+their columns. Migrations that rewrite existing rows commit their schema changes first and
+then one batch of rows at a time (MIGRATION_BATCH_SIZE), so they never hold row locks on
+the whole table while old workers are still writing to it; an interrupted run resumes with
+the rows that are left.
+
+Run once per deploy, before starting the new workers:
+    python migrations.py
+    python migrations.py --status
+"""
+import os
+import sys
+import argparse
+from datetime import datetime
+from sqlalchemy import text, inspect
+
+import geo
+
+# Arbitrary application-wide key for pg_advisory_lock
+MIGRATION_LOCK_ID = 7301
+
+MIGRATION_BATCH_SIZE = 1000  # Rows updated per transaction by data migrations
+
+MIGRATIONS = []  # (version, description, function(connection, metadata))
+
+
+def migration(version, description):
+    def register(function):
+        MIGRATIONS.append((version, description, function))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return function
+    return register
+
+
+# Helper function to add a column unless it already exists
+def add_column(connection, table, column, column_type):
+    columns = [col['name'] for col in inspect(connection).get_columns(table)]
+    if column not in columns:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+
+@migration(1, "Create tables")
+def create_tables(connection, metadata):
+    metadata.create_all(connection)
+
+
+@migration(2, "Add food, device and location columns to analysis")
+def add_analysis_details(connection, metadata):
+    add_column(connection, 'analysis', 'food_items', 'TEXT')
+    add_column(connection, 'analysis', 'ip_address', 'VARCHAR(50)')
+    add_column(connection, 'analysis', 'user_agent', 'TEXT')
+    add_column(connection, 'analysis', 'device_type', 'VARCHAR(20)')
+    add_column(connection, 'analysis', 'location', 'VARCHAR(255)')
+    add_column(connection, 'analysis', 'latitude', 'FLOAT')
+    add_column(connection, 'analysis', 'longitude', 'FLOAT')
+
+
+@migration(3, "Add total_kcal and the pagination index to analysis")
+def add_total_kcal(connection, metadata):
+    add_column(connection, 'analysis', 'total_kcal', 'INTEGER')
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_analysis_total_kcal ON analysis (total_kcal)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_analysis_created_at_id ON analysis (created_at, id)"))
+
+
+@migration(4, "Move user agent strings to the user_agent lookup table")
+def add_user_agent_table(connection, metadata):
+    user_agent = metadata.tables['user_agent']
+    user_agent.create(connection, checkfirst=True)
+    add_column(connection, 'analysis', 'user_agent_id', 'INTEGER REFERENCES user_agent (id)')
+    connection.commit()
+    # Move existing strings to the lookup table and clear them from the analysis rows, one batch of IDs at a time
+    max_length = user_agent.c.value.type.length
+    last_id = ''
+    while True:
+        ids = connection.execute(text(
+            "SELECT id FROM analysis WHERE id > :last_id AND user_agent IS NOT NULL ORDER BY id LIMIT :batch_size"
+        ), {'last_id': last_id, 'batch_size': MIGRATION_BATCH_SIZE}).scalars().all()
+        if not ids:
+            break
+        batch = {'last_id': last_id, 'batch_last_id': ids[-1]}
+        connection.execute(text(
+            f"INSERT INTO user_agent (value) SELECT DISTINCT substr(user_agent, 1, {max_length}) FROM analysis "
+            f"WHERE id > :last_id AND id <= :batch_last_id AND user_agent IS NOT NULL "
+            f"AND substr(user_agent, 1, {max_length}) NOT IN (SELECT value FROM user_agent)"
+        ), batch)
+        connection.execute(text(
+            f"UPDATE analysis SET user_agent_id = (SELECT id FROM user_agent WHERE value = substr(analysis.user_agent, 1, {max_length})), "
+            f"user_agent = NULL WHERE id > :last_id AND id <= :batch_last_id AND user_agent IS NOT NULL"
+        ), batch)
+        connection.commit()
+        last_id = ids[-1]
+
+
+@migration(5, "Add the geohash column and index to analysis")
+def add_geohash(connection, metadata):
+    add_column(connection, 'analysis', 'geohash', f"VARCHAR({geo.GEOHASH_PRECISION})")
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_analysis_geohash ON analysis (geohash)"))
+    connection.commit()
+    # Fill in the geohash of rows that already have coordinates, one batch at a time
+    last_id = ''
+    while True:
+        rows = connection.execute(text(
+            "SELECT id, latitude, longitude FROM analysis WHERE id > :last_id AND geohash IS NULL "
+            "AND latitude IS NOT NULL AND longitude IS NOT NULL ORDER BY id LIMIT :batch_size"
+        ), {'last_id': last_id, 'batch_size': MIGRATION_BATCH_SIZE}).all()
+        if not rows:
+            break
+        updates = [{'id': row[0], 'geohash': geo.encode(row[1], row[2])} for row in rows if geo.valid_coordinates(row[1], row[2])]
+        if updates:
+            connection.execute(text("UPDATE analysis SET geohash = :geohash WHERE id = :id"), updates)
+        connection.commit()
+        last_id = rows[-1][0]
+
+
+def ensure_version_table(connection):
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, description VARCHAR(255) NOT NULL, applied_at TIMESTAMP NOT NULL)"
+    ))
+    connection.commit()
+
+
+def applied_versions(connection):
+    return {row[0] for row in connection.execute(text("SELECT version FROM schema_version"))}
+
+
+# Apply every pending migration; returns the versions applied by this call
+def run_migrations(engine, metadata):
+    applied = []
+    with engine.connect() as connection:
+        locked = connection.dialect.name == 'postgresql'
+        if locked:
+            # Blocks until any other process running migrations has finished
+            connection.execute(text("SELECT pg_advisory_lock(:id)"), {'id': MIGRATION_LOCK_ID})
+            connection.commit()
+        try:
+            ensure_version_table(connection)
+            done = applied_versions(connection)
+            for version, description, function in MIGRATIONS:
+                if version in done:
+                    continue
+                print(f"Applying migration {version}: {description}")
+                try:
+                    function(connection, metadata)
+                    connection.execute(
+                        text("INSERT INTO schema_version (version, description, applied_at) VALUES (:version, :description, :applied_at)"),
+                        {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+                    )
+                    connection.commit()
+                except Exception:
+                    connection.rollback()
+                    raise
+                applied.append(version)
+        finally:
+            if locked:
+                connection.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': MIGRATION_LOCK_ID})
+                connection.commit()
+    return applied
+
+
+# Return the versions that have not been applied yet
+def pending_migrations(engine):
+    with engine.connect() as connection:
+        ensure_version_table(connection)
+        done = applied_versions(connection)
+    return [(version, description) for version, description, function in MIGRATIONS if version not in done]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply database schema migrations")
+    parser.add_argument('--status', action='store_true', help="List pending migrations without applying them")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as backend
+
+    with backend.app.app_context():
+        engine = backend.db.engine
+        if args.status:
+            pending = pending_migrations(engine)
+            for version, description in pending:
+                print(f"Pending migration {version}: {description}")
+            print(f"{len(pending)} pending migrations")
+            return
+        applied = run_migrations(engine, backend.db.metadata)
+        print(f"Applied {len(applied)} migrations" if applied else "Database schema is up to date")
+
+
+if __name__ == '__main__':
+    main()
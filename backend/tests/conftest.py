@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# The app module, running against a temporary SQLite database and fakeredis
+@pytest.fixture(scope='session')
+def backend(tmp_path_factory):
+    fakeredis = pytest.importorskip('fakeredis')
+    import redis
+
+    directory = tmp_path_factory.mktemp('backend')
+    os.environ['DATABASE_URL'] = f"sqlite:///{directory / 'test.db'}"
+    os.environ['IMAGE_STORE_DIR'] = str(directory / 'images')
+    os.environ['INFERENCE_BACKEND'] = 'stub'
+    server = fakeredis.FakeServer()
+    redis.Redis.from_url = classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+    import app
+
+    with app.app.app_context():
+        app.db.create_all()
+    return app
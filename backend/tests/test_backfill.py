@@ -0,0 +1,20 @@
+"""Tests for the backfill job's row processing and cache invalidation."""
+import json
+import uuid
+
+import backfill
+
+
+def test_parse_evicts_the_cached_upload_response(backend):
+    backfill.init_worker()
+    text = "Identified food: [apple (95 kcal)]. Estimated calories: 95 kcal."
+    row = {'id': str(uuid.uuid4()), 'image_filename': 'abc123.jpg', 'analysis_result': json.dumps(text),
+           'food_items': None, 'total_kcal': None}
+    updates, errors = backfill.process_chunk('parse', [row], False)
+    assert errors == []
+    assert updates[0]['image_hash'] == 'abc123' and updates[0]['total_kcal'] == 95
+
+    backend.cache_analysis('abc123', {'analysis': 'old'})
+    assert backend.get_cached_analysis('abc123') == {'analysis': 'old'}
+    backfill.invalidate_updated(updates)
+    assert backend.get_cached_analysis('abc123') is None
@@ -0,0 +1,10 @@
+"""Tests for the statistics reported by benchmark.py."""
+import benchmark
+
+
+def test_nearest_rank_percentile():
+    values = list(range(1, 101))
+    assert [benchmark.percentile(values, pct) for pct in (0, 7, 50, 95, 99, 100)] == [1, 7, 50, 95, 99, 100]
+    assert benchmark.percentile(list(range(1, 21)), 95) == 19
+    assert benchmark.percentile([5], 99) == 5
+    assert benchmark.percentile([], 50) is None
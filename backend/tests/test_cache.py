@@ -0,0 +1,36 @@
+"""Tests for the per-namespace index of cached keys behind /cache-stats."""
+import time
+import types
+
+import pytest
+
+
+@pytest.fixture
+def clock(backend, monkeypatch):
+    now = [time.time()]
+    fake_time = types.SimpleNamespace(time=lambda: now[0], monotonic=time.monotonic,
+                                      perf_counter=time.perf_counter, sleep=time.sleep)
+    monkeypatch.setattr(backend, 'time', fake_time)
+    monkeypatch.setattr(backend, 'CACHE_EXPIRATION', 10)
+    return now
+
+
+def index_size(backend, namespace):
+    return backend.redis_client.zcard(backend.cache_key(f"index:{namespace}"))
+
+
+def test_expired_entries_are_trimmed_on_write(backend, clock):
+    for i in range(100):
+        backend.cache_analysis(f"trim-{i}", {'analysis': 'test'})
+        clock[0] += 1
+    # Only the writes of the last CACHE_EXPIRATION seconds are left, without a /cache-stats call
+    assert index_size(backend, 'image_analysis') <= 11
+
+
+def test_invalidated_keys_leave_the_index(backend, clock):
+    clock[0] += 1000
+    backend.cache_analysis('invalidate-1', {'analysis': 'test'})
+    backend.cache_analysis('invalidate-2', {'analysis': 'test'})
+    assert backend.count_cache_keys(['image_analysis']) == {'image_analysis': 2}
+    backend.invalidate_cache_keys([backend.cache_key('image_analysis:invalidate-1')])
+    assert backend.count_cache_keys(['image_analysis']) == {'image_analysis': 1}
@@ -0,0 +1,157 @@
+"""Tests for the geohash helpers and /analyses/nearby, checked against a brute-force scan."""
+import math
+import uuid
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import geo
+
+# Boxes as (south, west, north, east); the last two cross the antimeridian
+BOXES = [
+    (51.45, -0.2, 51.55, 0.0),
+    (-60.0, -170.0, 70.0, 170.0),
+    (-18.0, 179.8, -17.5, -179.8),
+    (-20.0, 170.0, -15.0, -175.0),
+]
+
+
+def make_row(rng, created_at, lat, lng):
+    return {
+        'id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'analysis_result': '"test"',
+        'created_at': created_at,
+        'latitude': lat,
+        'longitude': lng,
+        'geohash': geo.encode(lat, lng),
+    }
+
+
+def in_box(lat, lng, box):
+    south, west, north, east = box
+    if not south <= lat <= north:
+        return False
+    return west <= lng <= east if west <= east else lng >= west or lng <= east
+
+
+def test_encode_known_value():
+    assert geo.encode(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+    assert geo.encode(-90, -180, 1) == '0'
+    assert geo.encode(90, 180, 1) == 'z'
+
+
+def test_prefix_upper_bound():
+    assert geo.prefix_upper_bound('b') == 'c'
+    assert geo.prefix_upper_bound('abz') == 'ac'
+    assert geo.prefix_upper_bound('zz') is None
+
+
+def test_prefix_ranges_merge_adjacent_cells():
+    assert geo.prefix_ranges(geo.covering_prefixes(-90, -180, 90, 180)[1]) == [('0', None)]
+    assert geo.prefix_ranges(['gcpvj0', 'gcpvj1', 'gcpvj2', 'gcpvj3']) == [('gcpvj0', 'gcpvj4')]
+
+
+def test_covering_contains_every_point_in_box():
+    rng = random.Random(1)
+    for _ in range(500):
+        south = rng.uniform(-90, 89)
+        north = rng.uniform(south, min(90, south + rng.choice([0.001, 0.1, 5, 60])))
+        west = rng.uniform(-180, 180)
+        east = west + rng.choice([0.001, 0.1, 5, 100, 300])
+        east = east - 360 if east > 180 else east
+        precision, prefixes = geo.covering_prefixes(south, west, north, east)
+        assert len(prefixes) <= 32 or precision == 1
+        for _ in range(5):
+            lat = rng.uniform(south, north)
+            lng = rng.uniform(west, east) if west <= east else rng.choice([rng.uniform(west, 180), rng.uniform(-180, east)])
+            assert any(geo.encode(lat, lng).startswith(prefix) for prefix in prefixes)
+
+
+def test_bbox_around_contains_radius():
+    rng = random.Random(2)
+    for lat, lng in [(51.5, -0.12), (0, 179.99), (-17.8, -179.95), (89.99, 0), (-89.9, 45)]:
+        box = geo.bbox_around(lat, lng, 20000)
+        for _ in range(200):
+            point_lat = max(-90, min(90, lat + rng.uniform(-0.3, 0.3)))
+            point_lng = (lng + rng.uniform(-3, 3) + 180) % 360 - 180
+            if geo.distance_m(lat, lng, point_lat, point_lng) <= 20000:
+                assert in_box(point_lat, point_lng, box)
+
+
+@pytest.fixture(scope='module')
+def nearby(backend):
+    rng = random.Random(3)
+    rows = []
+    start = datetime(2025, 1, 1)
+    for i in range(6000):
+        if i % 3 == 0:
+            lat, lng = rng.gauss(51.5, 0.2), rng.gauss(-0.12, 0.3)  # A dense city
+        elif i % 3 == 1:
+            lat, lng = rng.uniform(-60, 70), rng.uniform(-180, 180)
+        else:
+            lat, lng = rng.gauss(-17.8, 0.3), rng.choice([rng.uniform(179.5, 180), rng.uniform(-180, -179.5)])  # Across the antimeridian
+        rows.append(make_row(rng, start + timedelta(seconds=i), lat, lng))
+    # Points the flat-earth ranking orders wrongly: due north of (80, 0) is nearer than due east or west,
+    # and a ring of nearly equidistant points around Oslo
+    north = 80 + 10000 / geo.METERS_PER_DEGREE
+    east_west = 10300 / (geo.METERS_PER_DEGREE * math.cos(math.radians(80)))
+    for i, (lat, lng) in enumerate([(north, 0), (80, east_west), (80, -east_west)]):
+        rows.append(make_row(rng, start + timedelta(days=1, seconds=i), lat, lng))
+    for i in range(300):
+        distance, bearing = rng.uniform(3000, 3050), rng.uniform(0, 2 * math.pi)
+        lat = 59.91 + distance * math.cos(bearing) / geo.METERS_PER_DEGREE
+        lng = 10.75 + distance * math.sin(bearing) / (geo.METERS_PER_DEGREE * math.cos(math.radians(59.91)))
+        rows.append(make_row(rng, start + timedelta(days=2, seconds=i), lat, lng))
+    with backend.app.app_context():
+        backend.db.session.execute(backend.db.insert(backend.Analysis), rows)
+        backend.db.session.commit()
+    return backend.app.test_client(), rows
+
+
+@pytest.mark.parametrize('lat,lng,radius,limit', [
+    (51.5, -0.12, 2000, 100), (51.5, -0.12, 50000, 100), (-17.8, 179.99, 20000, 100), (10, 10, 50000, 100),
+    (80, 0, 50000, 1), (80, 0, 50000, 3), (59.91, 10.75, 5000, 5), (59.91, 10.75, 5000, 1),
+])
+def test_radius_matches_brute_force(nearby, lat, lng, radius, limit):
+    client, rows = nearby
+    response = client.get(f'/analyses/nearby?lat={lat}&lng={lng}&radius={radius}&limit={limit}&fields=id')
+    assert response.status_code == 200
+    expected = sorted((geo.distance_m(lat, lng, row['latitude'], row['longitude']), row['id']) for row in rows)
+    expected = [analysis_id for distance, analysis_id in expected if distance <= radius][:limit]
+    assert [analysis['id'] for analysis in response.json['analyses']] == expected
+
+
+@pytest.mark.parametrize('box', BOXES)
+def test_bbox_matches_brute_force(nearby, box):
+    client, rows = nearby
+    south, west, north, east = box
+    response = client.get(f'/analyses/nearby?bbox={west},{south},{east},{north}&limit=200&fields=id')
+    assert response.status_code == 200
+    inside = [row for row in rows if in_box(row['latitude'], row['longitude'], box)]
+    expected = [row['id'] for row in sorted(inside, key=lambda row: (row['created_at'], row['id']), reverse=True)[:200]]
+    assert [analysis['id'] for analysis in response.json['analyses']] == expected
+
+
+@pytest.mark.parametrize('box', BOXES)
+@pytest.mark.parametrize('zoom', [0, 5, 12])
+def test_clusters_only_count_points_in_box(nearby, box, zoom):
+    client, rows = nearby
+    south, west, north, east = box
+    response = client.get(f'/analyses/nearby?bbox={west},{south},{east},{north}&zoom={zoom}')
+    assert response.status_code == 200
+    clusters = response.json['clusters']
+    inside = [row for row in rows if in_box(row['latitude'], row['longitude'], box)]
+    if len(inside) and len(clusters) < 1000:
+        assert sum(cluster['count'] for cluster in clusters) == len(inside)
+    precision = response.json['precision']
+    cells = {row['geohash'][:precision] for row in inside}
+    for cluster in clusters:
+        assert cluster['geohash'] in cells
+
+
+def test_invalid_queries(nearby):
+    client, rows = nearby
+    for query in ['lat=1&lng=2', 'lat=91&lng=0&radius=5', 'lat=1&lng=1&radius=60000', 'bbox=1,2,3', 'bbox=0,10,1,5',
+                  'lat=1&lng=1&radius=5&zoom=30', 'lat=1&lng=1&radius=5&fields=bogus']:
+        assert client.get(f'/analyses/nearby?{query}').status_code == 400
@@ -0,0 +1,52 @@
+"""Tests for updating the location of an analysis that may not be written to the database yet."""
+import json
+import threading
+import uuid
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def client(backend, monkeypatch):
+    monkeypatch.setattr(backend, 'WRITE_BEHIND_FLUSH_INTERVAL', 0.05)
+    return backend.app.test_client()
+
+
+# Cache an analysis the way the uploading worker does before its write-behind queue writes the row
+def cache_upload(backend, analysis_id):
+    backend.redis_client.set(backend.cache_key(f"analysis:{analysis_id}"), json.dumps({'id': analysis_id}))
+
+
+def write_row(backend, analysis_id):
+    with backend.app.app_context():
+        backend.db.session.add(backend.Analysis(id=analysis_id, analysis_result='"test"', created_at=datetime.utcnow()))
+        backend.db.session.commit()
+
+
+def put_location(client, analysis_id):
+    return client.put(f'/analyses/{analysis_id}/location', json={'location': 'Home', 'coordinates': {}})
+
+
+def test_unknown_analysis_is_not_found(backend, client):
+    assert put_location(client, str(uuid.uuid4())).status_code == 404
+
+
+def test_waits_for_a_row_written_by_another_worker(backend, client):
+    analysis_id = str(uuid.uuid4())
+    cache_upload(backend, analysis_id)
+    writer = threading.Timer(0.08, write_row, (backend, analysis_id))
+    writer.start()
+    response = put_location(client, analysis_id)
+    writer.join()
+    assert response.status_code == 200
+    with backend.app.app_context():
+        assert backend.db.session.get(backend.Analysis, analysis_id).location == 'Home'
+
+
+def test_unwritten_analysis_is_retryable(backend, client):
+    analysis_id = str(uuid.uuid4())
+    cache_upload(backend, analysis_id)
+    response = put_location(client, analysis_id)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(backend.UNWRITTEN_ANALYSIS_RETRY_AFTER)
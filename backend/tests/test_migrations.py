@@ -0,0 +1,37 @@
+"""Tests for the data migrations, run in small batches on a database with the old schema."""
+import uuid
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+
+import geo
+import migrations
+
+
+def test_user_agents_and_geohashes_are_migrated_in_batches(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(migrations, 'MIGRATION_BATCH_SIZE', 7)
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    rows = [{'id': str(uuid.uuid4()), 'user_agent': f"agent {i % 5}" if i % 4 else None,
+             'latitude': i - 25.0, 'longitude': i * 3.0} for i in range(50)]
+    with engine.connect() as connection:
+        # The analysis table as of version 3, with the versions before 4 applied
+        connection.execute(text(
+            "CREATE TABLE analysis (id VARCHAR(36) PRIMARY KEY, created_at TIMESTAMP, analysis_result TEXT, "
+            "user_agent TEXT, latitude FLOAT, longitude FLOAT)"))
+        connection.execute(text("INSERT INTO analysis (id, user_agent, latitude, longitude) VALUES (:id, :user_agent, :latitude, :longitude)"), rows)
+        migrations.ensure_version_table(connection)
+        connection.execute(text("INSERT INTO schema_version VALUES (:version, 'old', :applied_at)"),
+                           [{'version': version, 'applied_at': datetime.utcnow()} for version in (1, 2, 3)])
+        connection.commit()
+
+    assert migrations.run_migrations(engine, backend.db.metadata) == [4, 5]
+
+    with engine.connect() as connection:
+        migrated = {row.id: row for row in connection.execute(text(
+            "SELECT analysis.id, analysis.user_agent, user_agent.value, analysis.geohash FROM analysis "
+            "LEFT JOIN user_agent ON user_agent.id = analysis.user_agent_id"))}
+        assert connection.execute(text("SELECT COUNT(*) FROM user_agent")).scalar() == 5
+    for row in rows:
+        assert migrated[row['id']].user_agent is None
+        assert migrated[row['id']].value == row['user_agent']
+        assert migrated[row['id']].geohash == geo.encode(row['latitude'], row['longitude'])
@@ -0,0 +1,39 @@
+"""Tests for parsing food items and calories out of the model's response text."""
+import json
+
+
+def test_items_and_total(backend):
+    fields = backend.extract_structured_fields(
+        "Identified food: [rice (200 kcal), chicken curry (1,250 kcal)]. Estimated calories: [1,450] kcal.")
+    assert fields['items'] == [('rice', 200), ('chicken curry', 1250)]
+    assert json.loads(json.loads(fields['food_items'])) == ['rice', 'chicken curry']
+    assert fields['total_kcal'] == 1450
+
+
+def test_ranges_use_the_midpoint(backend):
+    fields = backend.extract_structured_fields(
+        "Identified food: [rice (200-250 kcal), salad (~80–100 calories)]. Estimated calories: 280-350 kcal.")
+    assert fields['items'] == [('rice', 225), ('salad', 90)]
+    assert fields['total_kcal'] == 315
+
+
+def test_total_falls_back_to_item_sum(backend):
+    fields = backend.extract_structured_fields("Identified food: [apple (95 kcal), banana (105 kcal)]. Estimated calories: unknown")
+    assert fields['total_kcal'] == 200
+
+
+def test_lone_comma_is_not_a_number(backend):
+    fields = backend.extract_structured_fields("Identified food: apple, banana. Estimated calories: , unknown")
+    assert fields['items'] == [('apple', None), ('banana', None)]
+    assert fields['total_kcal'] is None
+
+
+def test_malformed_item_keeps_the_others(backend):
+    fields = backend.extract_structured_fields("Identified food: [pizza (, kcal), soda (150 kcal)]. Estimated calories: 400 kcal")
+    assert fields['items'] == [('pizza (, kcal)', None), ('soda', 150)]
+    assert fields['total_kcal'] == 400
+
+
+def test_no_food_found(backend):
+    fields = backend.extract_structured_fields("I can't see any food in this image.")
+    assert fields == {'food_items': None, 'total_kcal': None, 'items': []}
@@ -0,0 +1,302 @@
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+from metrics import REGISTRY
+
+# Client-side flow control for remote model calls, used by InferenceRouter in inference.py.
+# A call first waits for a concurrency slot (AdaptiveLimiter, per process, interactive requests
+# ahead of bulk work), then for a token from the request-rate bucket (TokenBucket, shared by
+# every worker through Redis). Retryable failures before the first chunk are retried with
+# jittered exponential backoff, and each outcome feeds back into the concurrency limit.
+
+# Priorities, lower is served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+QUEUE_LATENCY = REGISTRY.histogram('inference_queue_duration_seconds', 'Time spent waiting for a concurrency slot and rate limit token', ['priority'])
+INFERENCE_RETRIES = REGISTRY.counter('inference_retries_total', 'Retried remote inference calls', ['reason'])
+INFERENCE_REJECTED = REGISTRY.counter('inference_rejected_total', 'Remote inference calls rejected before being sent', ['reason'])
+CONCURRENCY_LIMIT = REGISTRY.gauge('inference_concurrency_limit', 'Current adaptive concurrency limit for remote inference')
+
+# HTTP status codes worth retrying: quota exhausted, and transient server errors
+OVERLOAD_STATUS_CODES = (429,)
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+# Raised when a call cannot be sent within the queue timeout
+class Overloaded(Exception):
+    pass
+
+
+# Helper function to classify an inference error
+# Returns 'overload' for quota errors, 'transient' for other retryable errors, or None
+# Google API errors carry the HTTP status in .code; timeouts and dropped connections are transient.
+def classify_error(e):
+    code = getattr(e, 'code', None)
+    try:
+        code = int(code) if code is not None else None
+    except (TypeError, ValueError):
+        code = None
+    if code in OVERLOAD_STATUS_CODES:
+        return 'overload'
+    if code in RETRYABLE_STATUS_CODES or isinstance(e, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return 'transient'
+    return None
+
+
+# Token bucket stored in a Redis hash so the rate holds across processes and hosts
+# Tokens may be reserved ahead of time: a caller that finds the bucket empty takes a token
+# from the future and sleeps until it is due, so waiting callers are served in arrival order.
+class TokenBucket:
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens < 1 then
+    wait = (1 - tokens) / rate
+    if wait > max_wait then
+        return tostring(-wait)
+    end
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - 1), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + math.ceil(max_wait) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, redis_client, key, rate, capacity):
+        self.key = key
+        self.rate = rate  # Tokens per second
+        self.capacity = capacity  # Largest burst
+        self.redis_client = redis_client
+        self.script = None  # Registered on first use, so creating the bucket does not touch Redis
+
+    # Take a token, returning the seconds to wait before using it
+    # Returns None if the token would not be due within max_wait (nothing is taken then).
+    # Fails open when Redis is unavailable, like the cache.
+    def reserve(self, max_wait):
+        try:
+            if self.script is None:
+                self.script = self.redis_client.register_script(self.SCRIPT)
+            wait = float(self.script(keys=[self.key], args=[self.rate, self.capacity, max_wait]))
+        except Exception as e:
+            print(f"Rate limiter error: {e}")
+            return 0
+        return None if wait < 0 else wait
+
+
+# Waiter in the AdaptiveLimiter queue; wake() is called with the limiter lock held
+class Waiter:
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+
+
+# Concurrency limit adjusted with AIMD: +1 per limit's worth of successful calls, and a
+# multiplicative decrease when a call is rejected for quota or is slower than the latency target.
+# Callers over the limit wait in a priority queue, FIFO within each priority.
+class AdaptiveLimiter:
+    def __init__(self, min_limit, max_limit, latency_target, backoff=0.7, decrease_interval=1.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target  # Seconds to first chunk
+        self.backoff = backoff
+        self.decrease_interval = decrease_interval  # Only shrink once per interval for a burst of failures
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.waiters = []  # Heap of (priority, sequence, Waiter)
+        self.sequence = itertools.count()
+        self.last_decrease = 0
+        self.lock = threading.Lock()
+        CONCURRENCY_LIMIT.set(self.limit)
+
+    # Take a slot now if one is free and nobody is queued, otherwise enqueue a waiter
+    def try_acquire(self, priority, wake):
+        with self.lock:
+            if self.in_flight < int(self.limit) and not self.waiters:
+                self.in_flight += 1
+                return None
+            waiter = Waiter(wake)
+            heapq.heappush(self.waiters, (priority, next(self.sequence), waiter))
+            return waiter
+
+    # Give up waiting; returns True if the slot was granted in the meantime
+    def cancel(self, waiter):
+        with self.lock:
+            if waiter.granted:
+                return True
+            waiter.cancelled = True
+            return False
+
+    # Hand free slots to queued waiters; the caller must hold the lock
+    def grant(self):
+        while self.waiters and self.in_flight < int(self.limit):
+            priority, sequence, waiter = heapq.heappop(self.waiters)
+            if waiter.cancelled:
+                continue
+            waiter.granted = True
+            self.in_flight += 1
+            waiter.wake()
+        # Drop cancelled waiters at the head so they do not block the fast path in try_acquire
+        while self.waiters and self.waiters[0][2].cancelled:
+            heapq.heappop(self.waiters)
+
+    # Block until a slot is free; returns False on timeout
+    def acquire(self, priority, timeout):
+        event = threading.Event()
+        waiter = self.try_acquire(priority, event.set)
+        if waiter is None or event.wait(timeout):
+            return True
+        return self.cancel(waiter)
+
+    async def aacquire(self, priority, timeout):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        waiter = self.try_acquire(priority, wake)
+        if waiter is None:
+            return True
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self.cancel(waiter)
+        except asyncio.CancelledError:
+            # The request went away; hand the slot back if it was already granted
+            if self.cancel(waiter):
+                self.release()
+            raise
+
+    # Free a slot and adjust the limit
+    # latency is the time to first chunk of a successful call; overloaded marks a quota rejection
+    def release(self, latency=None, overloaded=False):
+        with self.lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if overloaded or (latency is not None and latency > self.latency_target):
+                if now - self.last_decrease >= self.decrease_interval:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self.last_decrease = now
+            elif latency is not None:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            CONCURRENCY_LIMIT.set(round(self.limit, 2))
+            self.grant()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'queued': sum(1 for entry in self.waiters if not entry[2].cancelled),
+            }
+
+
+# Combines the concurrency limiter, the shared rate limit and retries around a streaming call
+class Throttle:
+    def __init__(self, limiter, bucket=None, max_retries=3, base_delay=0.5, max_delay=8.0, queue_timeout=30.0):
+        self.limiter = limiter
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.queue_timeout = queue_timeout  # Longest a call may wait for a slot and a token
+
+    # Full-jitter exponential backoff
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def rejected(self, reason):
+        INFERENCE_REJECTED.inc(reason=reason)
+        return Overloaded("The analysis service is busy, please try again shortly")
+
+    # Helper function to wait for a slot and a token; returns with a slot held
+    def wait_for_turn(self, priority, deadline):
+        start = time.monotonic()
+        if not self.limiter.acquire(priority, max(0, deadline - start)):
+            raise self.rejected('queue_timeout')
+        wait = self.bucket.reserve(max(0, deadline - time.monotonic())) if self.bucket else 0
+        if wait is None:
+            self.limiter.release()
+            raise self.rejected('rate_limit')
+        time.sleep(wait)
+        QUEUE_LATENCY.observe(time.monotonic() - start, priority=priority)
+
+    async def await_turn(self, priority, deadline):
+        start = time.monotonic()
+        if not await self.limiter.aacquire(priority, max(0, deadline - start)):
+            raise self.rejected('queue_timeout')
+        try:
+            wait = await asyncio.to_thread(self.bucket.reserve, max(0, deadline - time.monotonic())) if self.bucket else 0
+            if wait is None:
+                raise self.rejected('rate_limit')
+            await asyncio.sleep(wait)
+        except BaseException:
+            self.limiter.release()
+            raise
+        QUEUE_LATENCY.observe(time.monotonic() - start, priority=priority)
+
+    # Stream from start_stream() (a function returning a fresh text iterator) under the throttle
+    # Errors after the first chunk are not retried, so answers are never mixed.
+    def stream(self, start_stream, priority=PRIORITY_INTERACTIVE):
+        deadline = time.monotonic() + self.queue_timeout
+        for attempt in itertools.count():
+            self.wait_for_turn(priority, deadline)
+            start = time.monotonic()
+            latency = None
+            overloaded = False
+            try:
+                for text in start_stream():
+                    if latency is None:
+                        latency = time.monotonic() - start
+                    yield text
+                return
+            except Exception as e:
+                reason = classify_error(e)
+                overloaded = reason == 'overload'
+                if latency is not None or reason is None or attempt >= self.max_retries:
+                    raise
+                INFERENCE_RETRIES.inc(reason=reason)
+                print(f"Remote inference failed ({e}), retrying (attempt {attempt + 1} of {self.max_retries})")
+            finally:
+                self.limiter.release(latency, overloaded)
+            time.sleep(self.backoff(attempt))
+
+    async def astream(self, start_stream, priority=PRIORITY_INTERACTIVE):
+        deadline = time.monotonic() + self.queue_timeout
+        for attempt in itertools.count():
+            await self.await_turn(priority, deadline)
+            start = time.monotonic()
+            latency = None
+            overloaded = False
+            try:
+                async for text in start_stream():
+                    if latency is None:
+                        latency = time.monotonic() - start
+                    yield text
+                return
+            except Exception as e:
+                reason = classify_error(e)
+                overloaded = reason == 'overload'
+                if latency is not None or reason is None or attempt >= self.max_retries:
+                    raise
+                INFERENCE_RETRIES.inc(reason=reason)
+                print(f"Remote inference failed ({e}), retrying (attempt {attempt + 1} of {self.max_retries})")
+            finally:
+                self.limiter.release(latency, overloaded)
+            await asyncio.sleep(self.backoff(attempt))
+
+    def stats(self):
+        return self.limiter.stats()